@@ -0,0 +1,97 @@
+"""
+This is a class for deciding the timbre and volume of output notes.
+
+The formants (f1 to f5) of incoming notes are grouped into vowel clusters
+with online k-means. When a motif is queued, a formant and amplitude value
+for every one of its notes is computed in one go with NumPy and cached, so
+sending a note only needs to look the values up.
+"""
+import threading
+
+import numpy as np
+
+class ExpressionEngine:
+
+    def __init__(self, formant_min, formant_max, vowel_count=5, refresh_count=20, batch_size=10):
+        """
+        -formant_min and formant_max are the lowest and highest f1 to f5 values
+        -Until any notes are heard, the vowel clusters are spread evenly between them
+        -Cached trajectories are thrown away every refresh_count learned notes
+        -Single notes passed to add are learned batch_size at a time
+        """
+        self.formant_min = np.asarray(formant_min, dtype=float)
+        self.formant_max = np.asarray(formant_max, dtype=float)
+        self.centroids = np.linspace(self.formant_min, self.formant_max, vowel_count)
+        self.counts = np.zeros(vowel_count)
+        self.refresh_count = refresh_count
+        self.learned = 0
+        self.cache = {}
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.lock = threading.Lock()   # Clusters are learned and read from different threads
+
+    def add(self, formants):
+        """
+        -Holds on to the f1 to f5 values of one note until a batch is ready to learn
+        -Keeps NumPy work off the path of every single incoming note
+        """
+        with self.pending_lock:
+            self.pending.append(formants)
+            if (len(self.pending) < self.batch_size):
+                return
+            batch, self.pending = self.pending, []
+        self.learn(batch)
+
+    def learn(self, formants):
+        """
+        -Moves each vowel cluster towards the incoming formants nearest to it
+        -formants has one row of f1 to f5 per note
+        """
+        formants = np.asarray(formants, dtype=float).reshape(-1, len(self.formant_min))
+        with self.lock:
+            distances = ((formants[:, None, :] - self.centroids[None, :, :]) ** 2).sum(axis=2)
+            nearest = distances.argmin(axis=1)
+            batch_counts = np.bincount(nearest, minlength=len(self.centroids))
+            batch_sums = np.zeros_like(self.centroids)
+            np.add.at(batch_sums, nearest, formants)
+            updated = batch_counts > 0
+            new_counts = self.counts + batch_counts
+            self.centroids[updated] = ((self.centroids[updated] * self.counts[updated, None] + batch_sums[updated])
+                                       / new_counts[updated, None])
+            self.counts = new_counts
+
+            old_learned = self.learned
+            self.learned += len(formants)
+            if (self.learned // self.refresh_count != old_learned // self.refresh_count):
+                self.cache = {}
+
+    def trajectory(self, motif):
+        """
+        -Returns (formants, amplitudes) for every note of a pitch motif
+        -formants has one row of f1 to f5 per note
+        -The motif glides from one vowel to another, and higher notes are louder
+        """
+        key = tuple(motif)
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = self._compute(np.asarray(motif, dtype=float))
+            return self.cache[key]
+
+    def _compute(self, pitches):
+        if self.counts.any():
+            weights = self.counts / self.counts.sum()   # Vowels the human uses most are picked most
+        else:
+            weights = None
+        start, end = np.random.choice(len(self.centroids), 2, p=weights)
+        glide = np.linspace(0.0, 1.0, len(pitches))[:, None]
+        formants = (self.centroids[start] * (1.0 - glide)) + (self.centroids[end] * glide)
+        formants = np.clip(formants, self.formant_min, self.formant_max).round().astype(int)
+
+        pitch_range = pitches.max() - pitches.min()
+        if pitch_range:
+            height = (pitches - pitches.min()) / pitch_range
+        else:
+            height = np.full(len(pitches), 0.5)
+        amplitudes = 0.4 + (0.4 * height) + np.random.uniform(0.0, 0.2, len(pitches))
+        return formants, amplitudes
@@ -1,5 +1,6 @@
 """
-Written in Python 3.5.1
+Written in Python 3.5.1, now requires Python 3.8 or later
+(multiprocessing.shared_memory is used by the analysis worker)
 MIT License (c) Tim Bedford
 
 The goal of this file is to receive information that has been extracted
@@ -17,19 +18,30 @@ a dictionary or object.
 
 import argparse
 import math
+import os
 import curses
 import signal
 import sys
+import threading
 from queue import Queue
-from time import time
-from collections import Counter
+from time import time, sleep
+from collections import Counter, deque
+from multiprocessing import Process
 from copy import deepcopy
-from random import random, randint, randrange, choice, expovariate, uniform
+from random import random, randint, randrange, choice
 
+import numpy as np
 from music21 import *
 from pythonosc import dispatcher, osc_server, osc_message_builder, udp_client
 
 from note_class import MyNote
+from shared_ring import SharedRing
+from motif_selector import MotifSelector
+from profiler import SamplingProfiler
+from motif_index import MotifIndex, pitch_features, duration_features
+from scheduler import Scheduler, REALTIME, SOFT, BACKGROUND
+from token_alphabet import TokenAlphabet, token_size
+from expression import ExpressionEngine
 
 input_OSC_port = 5005          # The OSC port to receive data from P
 output_OSC_port = 6007         # The OSC port to send data to Q
@@ -40,14 +52,36 @@ f2min = 550; f2max = 1900
 f3min = 2550; f3max = 2850
 f4min = 2750; f4max = 3250
 f5min = 3000; f5max = 3600
-notelist_size = 20             # Number of notes to check when using motif_detection
+notelist_size = 20             # Number of notes to check when using detect_motif
 max_motif_num = 5
+queue_threshold = 10           # Queue a new motif when fewer notes than this are waiting
+max_motif_length = notelist_size   # Longest motif that fits in a motif_channel record
+analysis_in_worker = True      # Run detection/permutation in a separate process
+note_ring_size = 1024          # Records that can wait in note_ring before being dropped
+motif_channel_size = 256       # Motifs that can wait in motif_channel before being drained
+worker_poll_interval = 0.005   # Seconds the worker sleeps when note_ring is empty
+jitter_window = 500            # Number of output notes used when reporting jitter
+profile_directory = "profiles" # Where /profile/stop writes its output
+selection_mode = "random"      # "random", "similar" or "contrast" (see queue_next_motif)
+recent_note_count = 8          # Human notes compared against motifs when not in random mode
+neighbour_count = 3            # Number of nearest motifs to choose between
 
 human_pitches = []             # All notes played by the human
 human_durations = []
 motif_pool_pitches = []        # Pitched motifs derived from these notes
 motif_pool_durations = []      # Rhythmics motifs derived from these notes
+pitch_selector = MotifSelector()      # Weights for picking motifs from motif_pool_pitches
+duration_selector = MotifSelector()   # Weights for picking motifs from motif_pool_durations
+pitch_index = MotifIndex(pitch_features)         # Feature vectors for motif_pool_pitches
+duration_index = MotifIndex(duration_features)   # Feature vectors for motif_pool_durations
+# Every motif is also kept as a byte string of interned tokens, so that checking
+# whether a motif is already known is a set lookup.
+alphabets = {"pitch": TokenAlphabet(), "duration": TokenAlphabet()}
+known_motifs = {"pitch": set(), "duration": set()}
+expression = ExpressionEngine([f1min, f2min, f3min, f4min, f5min],
+                              [f1max, f2max, f3max, f4max, f5max])
 pitch_queue = Queue()          # Notes queued up to be output
+expression_queue = Queue()     # (amplitude, formants) for each note in pitch_queue
 duration_queue = Queue()
 current_pitch_motif = []
 current_duration_motif = []
@@ -57,6 +91,26 @@ cpm_queue = Queue()
 cdm_queue = Queue()
 last_time = time()*1000.0      # The last time the time was checked
 next_duration = 1000           # If this duration is passed, then next note will be sent to output
+output_lateness = deque(maxlen=jitter_window)   # How late (ms) each output note was sent
+
+# Records sent to the analysis worker through note_ring are (command, pitch, duration).
+# Motifs sent back through motif_channel are (parameter, is_human, length, values...).
+NOTE_COMMAND = 0
+DETECT_COMMAND = 1
+PERMUTATE_COMMAND = 2
+GENERATE_COMMAND = 3
+PROFILE_START_COMMAND = 4     # pitch carries trace_memory
+PROFILE_STOP_COMMAND = 5
+PARAMETERS = ["pitch", "duration"]
+note_record_format = "iii"
+motif_record_format = "iii{}i".format(max_motif_length)
+note_ring = None
+motif_channel = None
+dropped_records = 0
+dropped_lock = threading.Lock()   # OSC handlers run on many threads at once
+pool_lock = threading.Lock()      # Keeps each pool in step with its selector and index
+queue_lock = threading.Lock()     # Only one thread may add to or take from the note queues at a time
+profiler = SamplingProfiler()
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~Storing/Retrieving~~~~~~~~~~~~~~~~~~~~~~
@@ -97,15 +151,141 @@ def store_new_note(pitch, duration, amplitude, f1, f2, f3, f4, f5):
                       f1, f2, f3, f4, f5)
     human_pitches.append(int(pitch))
     human_durations.append(quantize_duration(duration))
+    expression.add([f1, f2, f3, f4, f5])
+    if analysis_in_worker:
+        send_to_worker(NOTE_COMMAND, int(pitch), quantize_duration(duration))
     input_to_screen(new_note)
 
 
+def store_new_notes(notes):
+    """Store a block of incoming notes at once.
+
+    This does the same job as store_new_note for every row of notes, but the
+    durations are quantized in a single step, the note lists are extended
+    once, and only the last note is displayed. It is meant for recorded
+    sessions and other sources that produce notes faster than P.
+
+    Motif detection normally only sees the last notelist_size notes, so the
+    whole block is also searched for motifs, one overlapping window at a
+    time (see batch_window_ends). When the worker does the analysis, this
+    waits for room in note_ring rather than dropping notes.
+
+    Arguments:
+      notes (array-like): One row per note, each row being
+         pitch, duration, amplitude, f1, f2, f3, f4, f5
+         (see store_new_note)
+
+    Returns:
+      None
+    """
+    global human_pitches, human_durations
+    notes = np.asarray(notes, dtype=float).reshape(-1, 8)
+    if not len(notes):
+        return
+    pitches = notes[:, 0].astype(int).tolist()
+    durations = quantize_durations(notes[:, 1]).tolist()
+    human_pitches.extend(pitches)
+    human_durations.extend(durations)
+    expression.learn(notes[:, 3:])
+    window_ends = batch_window_ends(len(pitches))
+    if analysis_in_worker:
+        # The worker keeps the last notelist_size notes, so asking it to
+        # detect after each window end searches exactly that window.
+        window_ends = set(window_ends)
+        for i, (pitch, duration) in enumerate(zip(pitches, durations)):
+            send_to_worker(NOTE_COMMAND, pitch, duration, wait=True)
+            if (i + 1) in window_ends:
+                send_to_worker(DETECT_COMMAND, wait=True)
+    else:
+        is_human = True
+        for end in window_ends:
+            start = max(end - notelist_size, 0)
+            for new_motif, parameter in detect_new_motifs(pitches[start:end], durations[start:end], known_motifs):
+                store_motif(new_motif, parameter, is_human)
+    last_note = notes[-1]
+    input_to_screen(MyNote(pitches[-1],
+                           durations[-1],
+                           last_note[2],
+                           *last_note[3:].tolist()))
+
+
+def batch_window_ends(count):
+    """List where each detection window of a batch of notes ends.
+
+    Windows are notelist_size notes long and start every notelist_size/2
+    notes, so a motif that crosses the edge of one window is still wholly
+    inside the next. The last window always ends at the last note.
+
+    Arguments:
+      count (int): Number of notes in the batch
+
+    Returns:
+      A list of ints (exclusive end indices)
+    """
+    step = max(notelist_size // 2, 1)
+    ends = list(range(notelist_size, count + 1, step))
+    if not ends or (ends[-1] != count):
+        ends.append(count)
+    return ends
+
+
+def store_motif(motif, parameter, is_human):
+    """Store a motif in the pool for its parameter and display it.
+
+    Arguments:
+      motif (list of ints)
+      parameter (string)
+      is_human (boolean): True if the motif was detected in the human's notes
+
+    Returns:
+      None
+    """
+    global motif_pool_pitches, motif_pool_durations
+    with pool_lock:
+        if (parameter == "pitch"):
+            motif_pool_pitches.append(motif)
+            pitch_selector.add(is_human)
+            pitch_index.add(motif)
+        elif (parameter == "duration"):
+            motif_pool_durations.append(motif)
+            duration_selector.add(is_human)
+            duration_index.add(motif)
+        known_motifs[parameter].add(alphabets[parameter].encode(motif))
+    motif_to_screen(motif, parameter, is_human)
+
+
+def select_motif_index(selector, index, human_notes):
+    """Pick which motif in a pool to play next.
+
+    In "random" mode the motif is drawn from selector. In "similar" mode it is
+    one of the neighbour_count motifs closest to the human's last few notes,
+    and in "contrast" mode one of the neighbour_count furthest from them. If
+    the human hasn't sung enough yet, "random" mode is used.
+
+    Arguments:
+      selector (MotifSelector)
+      index (MotifIndex)
+      human_notes (list of ints): Every note of this parameter sung so far
+
+    Returns:
+      An int
+    """
+    if (selection_mode == "random") or (len(human_notes) < 2):
+        return selector.sample()
+    phrase = human_notes[(-1 * recent_note_count):]
+    candidates = index.nearest(phrase, neighbour_count, selection_mode == "contrast")
+    return int(choice(candidates))
+
+
 def queue_next_motif():
     """Queue the next motif to be sent to Q.
 
-    If only 10 notes are in pitch_queue, one of the motifs in motif_pool_pitches
-    is selected and each note is individually added to pitch_queue. More recent
-    motifs are more likely to be selected.
+    If fewer than queue_threshold notes are in pitch_queue, one of the motifs in motif_pool_pitches
+    is selected (see select_motif_index) and each note is individually added to
+    pitch_queue. In "random" mode, more recent motifs and motifs detected from
+    the human are more likely to be selected, and motifs become less likely to
+    be selected each time they are played. The amplitude and formants of each
+    pitch are looked up (see ExpressionEngine) and added to expression_queue.
 
     Once rhythmic motifs are added, this function will become more complicated
     as it will have to create truly new notes, not just notes with all but one
@@ -118,31 +298,43 @@ def queue_next_motif():
       None
     """
     global motif_pool_pitches, motif_pool_durations, pitch_queue, duration_queue, cpm_queue, cdm_queue
-    if (pitch_queue.qsize() < 10):
-        motif_index = (len(motif_pool_pitches)-1) - int(len(motif_pool_pitches)*expovariate(3.0))
+    # Everything is worked out before taking queue_lock, which retrieve_next_note
+    # also needs, so that only the puts can hold up note output.
+    if (pitch_queue.qsize() < queue_threshold):
+        motif_index = select_motif_index(pitch_selector, pitch_index, human_pitches)
+        pitch_selector.played(motif_index)
         selected_motif = motif_pool_pitches[motif_index]
+        formants, amplitudes = expression.trajectory(selected_motif)
+        note_expressions = list(zip(amplitudes.tolist(), formants.tolist()))
         repetitions = randint(1, 6)
-        for i in range(repetitions):
-            for current_note in selected_motif:
-                pitch_queue.put(current_note)
-            cpm_queue.put(selected_motif)
-    if (duration_queue.qsize() < 10):
-        motif_index = (len(motif_pool_durations)-1) - int(len(motif_pool_durations)*expovariate(3.0))
+        with queue_lock:
+            for i in range(repetitions):
+                for current_note, note_expression in zip(selected_motif, note_expressions):
+                    pitch_queue.put(current_note)
+                    expression_queue.put(note_expression)
+                cpm_queue.put(selected_motif)
+    if (duration_queue.qsize() < queue_threshold):
+        motif_index = select_motif_index(duration_selector, duration_index, human_durations)
+        duration_selector.played(motif_index)
         selected_motif = motif_pool_durations[motif_index]
         repetitions = randint(1, 6)
-        for i in range(repetitions):
-            for current_note in selected_motif:
-                duration_queue.put(current_note)
-            cdm_queue.put(selected_motif)
+        with queue_lock:
+            for i in range(repetitions):
+                for current_note in selected_motif:
+                    duration_queue.put(current_note)
+                cdm_queue.put(selected_motif)
 
 
 def retrieve_next_note():
     """Output the next note in the queue.
 
     If the current note has finished sounding, then the next note in pitch_queue
-    is sent to Q and displayed in its own window in the curses interface.
+    is sent to Q, along with the amplitude and formants precomputed for it in
+    expression_queue, and displayed in its own window in the curses interface.
 
     This function should be called from outside the program as often as possible.
+    If the queues have run dry, nothing is sent until they are refilled,
+    rather than waiting (and holding up the caller) for a refill.
 
     Arguments:
       None
@@ -151,33 +343,38 @@ def retrieve_next_note():
       None
     """
     global next_duration, last_time, pitch_queue, duration_queue, current_pitch_motif, current_duration_motif, cpm_count, cdm_count
-    current_time = time()*1000.0  # Convert from seconds to milliseconds
-    if (next_duration <= (current_time - last_time)):
-        current_pitch = pitch_queue.get()
-        current_duration = duration_queue.get()
-        next_duration = current_duration
-        send_note(current_pitch,
-                  current_duration,
-                  uniform(0.4, 1.0),
-                  f1min, f2min, f3min, f4min, f5min)
-        output_to_screen("P: {}, D: {}".format(current_pitch, current_duration))
-        last_time = time()*1000.0
-
-        if (cpm_count >= len(current_pitch_motif)):
-            current_motif = cpm_queue.get()
-            cpm_to_screen(current_motif)
-            cpm_count = 1
-            current_pitch_motif = current_motif
-        else:
-            cpm_count += 1
-
-        if (cdm_count >= len(current_duration_motif)):
-            current_motif = cdm_queue.get()
-            cdm_to_screen(current_motif)
-            cdm_count = 1
-            current_duration_motif = current_motif
-        else:
-            cdm_count += 1
+    with queue_lock:    # Keeps pitch_queue, duration_queue and expression_queue in step
+        current_time = time()*1000.0  # Convert from seconds to milliseconds
+        if (next_duration <= (current_time - last_time)):
+            if (pitch_queue.empty() or duration_queue.empty()):
+                return
+            output_lateness.append((current_time - last_time) - next_duration)
+            current_pitch = pitch_queue.get()
+            current_duration = duration_queue.get()
+            current_amplitude, current_formants = expression_queue.get()
+            next_duration = current_duration
+            send_note(current_pitch,
+                      current_duration,
+                      current_amplitude,
+                      *current_formants)
+            output_to_screen("P: {}, D: {}".format(current_pitch, current_duration))
+            last_time = time()*1000.0
+
+            if (cpm_count >= len(current_pitch_motif)):
+                current_motif = cpm_queue.get()
+                cpm_to_screen(current_motif)
+                cpm_count = 1
+                current_pitch_motif = current_motif
+            else:
+                cpm_count += 1
+
+            if (cdm_count >= len(current_duration_motif)):
+                current_motif = cdm_queue.get()
+                cdm_to_screen(current_motif)
+                cdm_count = 1
+                current_duration_motif = current_motif
+            else:
+                cdm_count += 1
 
 
 def send_note(pitch, duration, amplitude, f1, f2, f3, f4, f5):
@@ -216,47 +413,54 @@ def send_note(pitch, duration, amplitude, f1, f2, f3, f4, f5):
 # These functions are for analyzing notes or phrases.
 
 
-def motif_detection(notelist, parameter):
-    """Detect motifs within parameter sequence.
+def detect_motif(notelist, known, alphabet):
+    """Detect a new motif within parameter sequence.
 
     Find the longest sequence in a list that appears more than once and has not
     already been detected. These sequences are intended to be recognizable
     musical motifs. Either pitch or duration can be detected.
 
+    The list is encoded as a byte string of tokens first, so that every
+    candidate sequence is a bytes slice that can be counted and looked up in C.
+
     Arguments:
-      notelist (list of ints)
-      parameter (string)
+      notelist (list of values)
+      known (set of bytes): Encoded motifs that have already been saved
+      alphabet (TokenAlphabet)
 
     Returns:
-      None
+      A list of values, or None if no new motif was found
     """
-    global motif_pool_pitches, motif_pool_durations
-    subnotelist_coll = []
-    for i in range(len(notelist)//2, 1, -1):  # Each possible sublist length
-        subnotelist = []
-        for j in range(0, len(notelist)-(i-1)):
-            subnotelist.append(tuple(notelist[j:j+i]))
-        subnotelist_coll.append(subnotelist)
+    encoded = alphabet.encode(notelist)
+    for i in range(len(notelist)//2, 1, -1):  # Each possible sublist length, longest first
+        width = i * token_size
+        cnt = Counter(encoded[j:j+width] for j in range(0, len(encoded)-width+1, token_size))
+        best_motif, count = cnt.most_common(1)[0]
+        if (count > 1):
+            # Return the longest motif, if it hasn't been saved already
+            if (best_motif in known):
+                return None
+            return alphabet.decode(best_motif)
+    return None
+
+
+def detect_new_motifs(pitchlist, durationlist, known):
+    """Detect new pitch and duration motifs.
 
-    # Make a Counter object for each list of possible motifs
-    cnt = [Counter(subnotelist) for subnotelist in subnotelist_coll]
-
-    # Grab the most common motif from each Counter
-    most_common_motifs = [c.most_common(1)[0][0] for c in cnt if c.most_common(1)[0][1] > 1]
+    Arguments:
+      pitchlist (list of ints)
+      durationlist (list of ints)
+      known (dictionary of sets of bytes): Encoded motifs for each parameter
 
-    # Save the longest motif, if the list isn't empty and hasn't been saved already
-    if (parameter == "pitch"):
-        if (most_common_motifs and (list(most_common_motifs[0]) not in motif_pool_pitches)):
-            best_motif = list(most_common_motifs[0])
-            is_human = True
-            motif_to_screen(best_motif, "pitch", is_human)
-            motif_pool_pitches.append(best_motif)
-    elif (parameter == "duration"):
-        if (most_common_motifs and (list(most_common_motifs[0]) not in motif_pool_durations)):
-            best_motif = list(most_common_motifs[0])
-            is_human = True
-            motif_to_screen(best_motif, "duration", is_human)
-            motif_pool_durations.append(best_motif)
+    Returns:
+      A list of (motif, parameter) tuples
+    """
+    new_motifs = []
+    for parameter, notelist in (("pitch", pitchlist), ("duration", durationlist)):
+        new_motif = detect_motif(notelist, known[parameter], alphabets[parameter])
+        if new_motif:
+            new_motifs.append((new_motif, parameter))
+    return new_motifs
 
 
 def quantize_duration(dur):
@@ -279,38 +483,78 @@ def quantize_duration(dur):
         return int(round(dur / 500.0) * 500.0)
 
 
+def quantize_durations(durs):
+    """Quantize an array of durations the same way as quantize_duration.
+
+    Arguments:
+      durs (array of floats)
+
+    Returns:
+      An array of ints
+    """
+    return np.clip(np.round(np.asarray(durs, dtype=float) / 500.0) * 500.0, 500, 2000).astype(int)
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~Generative Functions~~~~~~~~~~~~~~~~~~~~~~
 # These functions are for the purpose of generating new material.
 
 
-def generate_motif(parameter):
-    """Generate a random motif.
+def random_motif(parameter):
+    """Make a random motif.
 
-    Store a new motif of the designated paramter. The motif is two to five
-    values long. The motif should have no relation to anything the vocalist
-    is doing.
+    The motif is two to five values long. The motif should have no relation
+    to anything the vocalist is doing.
 
     Arguments:
       parameter (string)
 
     Returns:
-      None
+      A list of ints
     """
-    global motif_pool_pitches, motif_pool_durations
     new_motif = []
     phrase_length = randint(2, 5)
     if (parameter == "pitch"):
         for i in range(phrase_length):
             new_motif.append(randint(lowest_pitch, highest_pitch))
-        motif_pool_pitches.append(new_motif)
-        not_human = False
-        motif_to_screen(new_motif, "pitch", not_human)
     elif (parameter == "duration"):
         for i in range(phrase_length):
             new_motif.append(randrange(500, 1501, 500))
-        motif_pool_durations.append(new_motif)
-        not_human = False
-        motif_to_screen(new_motif, "duration", not_human)
+    return new_motif
+
+
+def generate_motif(parameter):
+    """Generate a random motif.
+
+    Store a new motif of the designated paramter.
+
+    Arguments:
+      parameter (string)
+
+    Returns:
+      None
+    """
+    new_motif = random_motif(parameter)
+    not_human = False
+    store_motif(new_motif, parameter, not_human)
+
+
+def new_permutation(motif_pool, known, parameter):
+    """Make a motif that isn't in motif_pool by permutating one that is.
+
+    Arguments:
+      motif_pool (list of lists of ints)
+      known (set of bytes): The encoded motifs in motif_pool
+      parameter (string)
+
+    Returns:
+      A list of ints
+    """
+    alphabet = alphabets[parameter]
+    old_motif = choice(motif_pool)
+    new_motif = permutate_motif(list(old_motif), parameter)   # Generate a new motif by permutating one of the saved motifs
+    while (alphabet.encode(new_motif) in known):   # If the new motif has already been generated, generate a new motif
+        new_motif = permutate_motif(list(choice(motif_pool)), parameter)
+    return new_motif
 
 
 def permutate_motif(motif, parameter):
@@ -504,6 +748,416 @@ def make_phrase_intune(motif):
     return new_motif
 
 
+# ~~~~~~~~~~~~~~~~~~~~~~Analysis Worker~~~~~~~~~~~~~~~~~~~~~~~~~
+# Motif detection, permutation and generation run in a separate process so
+# that a slow analysis pass never delays an outgoing note. The real-time
+# process only pushes fixed-size records into note_ring and pops finished
+# motifs from motif_channel, both of which are O(1).
+
+
+def start_analysis_worker():
+    """Create the shared rings and launch the analysis worker.
+
+    The worker is given a copy of the motifs generated so far so that its
+    pools match the ones in this process.
+
+    Arguments:
+      None
+
+    Returns:
+      The worker's Process object
+    """
+    global note_ring, motif_channel
+    note_ring = SharedRing(note_record_format, note_ring_size)
+    motif_channel = SharedRing(motif_record_format, motif_channel_size)
+    worker = Process(target=analysis_worker,
+                     args=(note_ring.name, motif_channel.name,
+                           motif_pool_pitches, motif_pool_durations),
+                     daemon=True)
+    worker.start()
+    return worker
+
+
+def stop_analysis_worker():
+    """Free the shared rings.
+
+    The worker itself is a daemon process and ends along with this one.
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    for ring in (note_ring, motif_channel):
+        if ring is not None:
+            ring.close(unlink=True)
+
+
+def send_to_worker(command, pitch=0, duration=0, wait=False):
+    """Push a note or a command into note_ring.
+
+    If the worker has fallen so far behind that the ring is full, the record
+    is dropped rather than making the caller wait, unless wait is True.
+
+    Arguments:
+      command (int): One of the *_COMMAND constants
+      pitch (int)
+      duration (int)
+      wait (boolean): Wait for room instead of dropping the record
+
+    Returns:
+      None
+    """
+    global dropped_records
+    while not note_ring.push((command, pitch, duration)):
+        if not wait:
+            with dropped_lock:
+                dropped_records += 1
+            return
+        sleep(worker_poll_interval)
+
+
+def drain_motif_channel():
+    """Store every motif the worker has published since the last call.
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    record = motif_channel.pop()
+    while record is not None:
+        parameter, is_human, length = record[:3]
+        store_motif(list(record[3:3+length]), PARAMETERS[parameter], bool(is_human))
+        record = motif_channel.pop()
+
+
+def publish_motif(channel, motif, parameter, is_human):
+    """Send a motif from the worker back to the real-time process.
+
+    Motifs are never dropped, so the worker waits if the channel is full.
+
+    Arguments:
+      channel (SharedRing)
+      motif (list of ints)
+      parameter (string)
+      is_human (boolean)
+
+    Returns:
+      None
+    """
+    padding = [0] * (max_motif_length - len(motif))
+    record = [PARAMETERS.index(parameter), int(is_human), len(motif)] + motif + padding
+    while not channel.push(record):
+        sleep(worker_poll_interval)
+
+
+def analysis_worker(note_ring_name, motif_channel_name, seed_pitches, seed_durations):
+    """Run motif detection, permutation and generation until the program ends.
+
+    This is the target of the worker process. It keeps its own copy of the
+    motif pools and of the most recent human notes.
+
+    Arguments:
+      note_ring_name (string)
+      motif_channel_name (string)
+      seed_pitches (list of lists of ints)
+      seed_durations (list of lists of ints)
+
+    Returns:
+      None
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl-C is handled by the real-time process
+    incoming = SharedRing(note_record_format, note_ring_size, note_ring_name)
+    outgoing = SharedRing(motif_record_format, motif_channel_size, motif_channel_name)
+    pools = {"pitch": list(seed_pitches), "duration": list(seed_durations)}
+    known = {}
+    for parameter in PARAMETERS:
+        known[parameter] = set(alphabets[parameter].encode(motif) for motif in pools[parameter])
+    recent = {"pitch": deque(maxlen=notelist_size), "duration": deque(maxlen=notelist_size)}
+
+    def keep(new_motif, parameter, is_human):
+        pools[parameter].append(new_motif)
+        known[parameter].add(alphabets[parameter].encode(new_motif))
+        publish_motif(outgoing, new_motif, parameter, is_human)
+
+    while True:
+        record = incoming.pop()
+        if record is None:
+            sleep(worker_poll_interval)
+            continue
+        command, pitch, duration = record
+        if (command == NOTE_COMMAND):
+            recent["pitch"].append(pitch)
+            recent["duration"].append(duration)
+        elif (command == DETECT_COMMAND):
+            for new_motif, parameter in detect_new_motifs(list(recent["pitch"]), list(recent["duration"]), known):
+                keep(new_motif, parameter, True)
+        elif (command == PERMUTATE_COMMAND):
+            for parameter in PARAMETERS:
+                keep(new_permutation(pools[parameter], known[parameter], parameter), parameter, False)
+        elif (command == GENERATE_COMMAND):
+            parameter = choice(PARAMETERS)
+            keep(random_motif(parameter), parameter, False)
+        elif (command == PROFILE_START_COMMAND):
+            profiler.start(bool(pitch))
+        elif (command == PROFILE_STOP_COMMAND) and profiler.running:
+            write_profile("worker", [("recent", recent),
+                                     ("motif_pool_pitches", pools["pitch"]),
+                                     ("motif_pool_durations", pools["duration"]),
+                                     ("known_motifs", known)])
+
+
+def report_jitter():
+    """Display how late output notes have been sent.
+
+    Lateness is how long after its deadline (the previous note's duration)
+    each note actually went out. Comparing these numbers with
+    analysis_in_worker set to True and False shows how much analysis load
+    affects the output. measure_jitter.py makes the same comparison under a
+    fixed, repeatable load.
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    if not output_lateness:
+        return
+    mean_lateness = sum(output_lateness) / len(output_lateness)
+    info_check("Late (ms) mean {:.1f} max {:.1f}, dropped {}\n".format(
+        mean_lateness, max(output_lateness), dropped_records))
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~Profiling~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# These functions allow a profiler to be switched on and off mid-performance
+# without restarting (and losing every motif).
+
+
+def start_profiling(trace_memory):
+    """Start sampling the stacks of every thread in this process.
+
+    If analysis runs in the worker process, the worker is asked to start its
+    own profiler too, since that is where detection and permutation happen.
+
+    Arguments:
+      trace_memory (boolean): Also record memory allocations with tracemalloc
+
+    Returns:
+      None
+    """
+    profiler.start(trace_memory)
+    if analysis_in_worker:
+        send_to_worker(PROFILE_START_COMMAND, int(trace_memory))
+    info_check("Profiling started\n")
+
+
+def stop_profiling():
+    """Stop the profiler and write its results to profile_directory.
+
+    If analysis runs in the worker process, the worker writes its own set of
+    files, named "worker-" instead of "f-".
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    if not profiler.running:
+        return
+    if analysis_in_worker:
+        send_to_worker(PROFILE_STOP_COMMAND)
+    structures = [("human_pitches", human_pitches),
+                  ("human_durations", human_durations),
+                  ("motif_pool_pitches", motif_pool_pitches),
+                  ("motif_pool_durations", motif_pool_durations)]
+    base_path = write_profile("f", structures)
+    info_check("Profile written to {}\n".format(base_path))
+
+
+def write_profile(process_name, structures):
+    """Stop the profiler and write what it found.
+
+    Three files are written, all named with the process and the time
+    profiling stopped: collapsed stacks (.folded), the largest allocations if
+    memory was traced (.memory), and the number of items and deep size of
+    each structure (.sizes).
+
+    Arguments:
+      process_name (string)
+      structures (list of (string, list) tuples)
+
+    Returns:
+      The path the files were written to, without an extension
+    """
+    os.makedirs(profile_directory, exist_ok=True)
+    base_path = os.path.join(profile_directory, "{}-{}".format(process_name, int(time())))
+    profiler.stop(base_path + ".folded", base_path + ".memory")
+    with open(base_path + ".sizes", "w") as sizes_file:
+        for name, structure in structures:
+            sizes_file.write("{} {} items {} bytes including contents\n".format(
+                name, len(structure), deep_size(structure)))
+    return base_path
+
+
+def deep_size(structure):
+    """Measure a container along with everything in it.
+
+    Objects reached more than once (e.g. small ints) are only counted once.
+
+    Arguments:
+      structure (any object)
+
+    Returns:
+      An int (bytes)
+    """
+    seen = set()
+    pending = [structure]
+    total = 0
+    while pending:
+        item = pending.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            pending.extend(item)
+    return total
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~Scheduling~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# P triggers every task on a fixed timer no matter how busy f is. Each OSC
+# message is passed to the scheduler with a priority, so that housekeeping
+# is deferred or dropped rather than pushing a note past its deadline.
+
+
+def time_to_next_output():
+    """Return the milliseconds left before the next note is due.
+
+    This is negative if the next note is already late.
+
+    Arguments:
+      None
+
+    Returns:
+      A float
+    """
+    return next_duration - (time()*1000.0 - last_time)
+
+
+def refill_queues():
+    """Store motifs from the worker, then top up the note queues.
+
+    A refill can be running on a deferred task's thread while /queuenextmotif
+    starts another, so queue_next_motif holds queue_lock while it adds each
+    motif's notes, to keep them (and their expression values) together.
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    if analysis_in_worker:
+        drain_motif_channel()
+    queue_next_motif()
+
+
+def refill_priority():
+    """Decide how urgent refilling the queues is.
+
+    A refill is normally SOFT: while notes are still waiting it can safely
+    be put off until after the next one goes out. Once either queue is
+    empty, nothing more can be output until it is refilled, so the refill
+    can't be shed.
+
+    Arguments:
+      None
+
+    Returns:
+      REALTIME or SOFT
+    """
+    if pitch_queue.empty() or duration_queue.empty():
+        return REALTIME
+    return SOFT
+
+
+def run_generation():
+    """Generate one random motif of a random parameter.
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    if analysis_in_worker:
+        send_to_worker(GENERATE_COMMAND)
+    else:
+        generate_motif(choice(PARAMETERS))
+
+
+def run_permutation():
+    """Store one new permutation of a pitch motif and of a duration motif.
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    global motif_pool_pitches, motif_pool_durations
+
+    if analysis_in_worker:
+        send_to_worker(PERMUTATE_COMMAND)
+        return
+
+    not_human = False
+    store_motif(new_permutation(motif_pool_pitches, known_motifs["pitch"], "pitch"), "pitch", not_human)
+    store_motif(new_permutation(motif_pool_durations, known_motifs["duration"], "duration"), "duration", not_human)
+
+
+def run_motif_detection():
+    """Look for new motifs in the human's most recent notes.
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    global human_pitches, motif_pool_pitches, human_durations, motif_pool_durations
+
+    if analysis_in_worker:
+        send_to_worker(DETECT_COMMAND)
+        return
+
+    is_human = True
+    pitchlist = human_pitches[(-1 * notelist_size):]
+    durationlist = human_durations[(-1 * notelist_size):]
+    for new_motif, parameter in detect_new_motifs(pitchlist, durationlist, known_motifs):
+        store_motif(new_motif, parameter, is_human)
+
+
+def report_shedding():
+    """Display how much work the scheduler has deferred or dropped.
+
+    Arguments:
+      None
+
+    Returns:
+      None
+    """
+    info_check("Shed: {}\n".format(scheduler.report()))
+
+
 # ~~~~~~~~~~~~~~~~~~~~OSC Functions~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # These functions are only called through OSC messages.
 # Their purpose is to call similarly named functions without the baggage of OSC addresses as inputs.
@@ -513,46 +1167,53 @@ def osc_store_new_note(unused_addr, pitch, duration, amplitude, f1, f2, f3, f4,
     store_new_note(pitch, duration, amplitude, f1, f2, f3, f4, f5)
 
 
+def osc_store_new_notes(unused_addr, *values):
+    if (len(values) % 8):
+        info_check("/notes needs 8 values per note, got {}\n".format(len(values)))
+        return
+    store_new_notes(values)
+
+
 def osc_generate_motif(unused_addr):
-    generate_motif(choice("pitch", "duration"))
+    scheduler.run("generatemotif", BACKGROUND, run_generation)
 
 
 def osc_queue_next_motif(unused_addr):
-    queue_next_motif()
+    scheduler.run("queuenextmotif", refill_priority(), refill_queues)
 
 
 def osc_retrieve_next_note(unused_addr):
-    retrieve_next_note()
+    scheduler.run("retrievenextnote", REALTIME, retrieve_next_note)
 
 
 def osc_permutate_motif(unused_addr):
-    global motif_pool_pitches, motif_pool_durations
+    scheduler.run("permutatemotif", BACKGROUND, run_permutation)
 
-    old_motif = choice(motif_pool_pitches)
-    new_motif = permutate_motif(old_motif, "pitch")        # Generate a new motif by permutating one of the saved motifs
-    while (new_motif in motif_pool_pitches):      # If the new motif has already been generated, generate a new motif
-        new_motif = permutate_motif(choice(motif_pool_pitches), "pitch")
-    motif_pool_pitches.append(new_motif)
-    not_human = False
-    motif_to_screen(new_motif, "pitch", not_human)
 
-    old_motif = choice(motif_pool_durations)
-    new_motif = permutate_motif(old_motif, "duration")        # Generate a new motif by permutating one of the saved motifs
-    while (new_motif in motif_pool_durations):      # If the new motif has already been generated, generate a new motif
-        new_motif = permutate_motif(choice(motif_pool_durations), "duration")
-    motif_pool_durations.append(new_motif)
-    not_human = False
-    motif_to_screen(new_motif, "duration", not_human)
+def osc_motif_detection(unused_addr):
+    scheduler.run("motifdetection", BACKGROUND, run_motif_detection)
 
 
-def osc_motif_detection(unused_addr):
-    global human_pitches, motif_pool_pitches, human_durations, motif_pool_durations
+def osc_report_jitter(unused_addr):
+    report_jitter()
 
-    pitchlist = human_pitches[(-1 * notelist_size):]
-    motif_detection(pitchlist, "pitch")
 
-    durationlist = human_durations[(-1 * notelist_size):]
-    motif_detection(durationlist, "duration")
+def osc_report_shedding(unused_addr):
+    report_shedding()
+
+
+def osc_selection_mode(unused_addr, mode):
+    global selection_mode
+    if mode in ("random", "similar", "contrast"):
+        selection_mode = mode
+
+
+def osc_profile_start(unused_addr, trace_memory=0):
+    start_profiling(bool(trace_memory))
+
+
+def osc_profile_stop(unused_addr):
+    stop_profiling()
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~Curses~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -710,6 +1371,7 @@ def signal_handler(signal, frame):
         -https://stackoverflow.com/questions/4205317/capture-keyboardinterrupt-in-python-without-try-except
     """
     curses.endwin()
+    stop_analysis_worker()
     sys.exit(0)
 
 
@@ -779,11 +1441,20 @@ if __name__ == "__main__":
     # to the designated function.
     dispatcher = dispatcher.Dispatcher()
     dispatcher.map("/note", store_new_note)
+    dispatcher.map("/notes", osc_store_new_notes)
     dispatcher.map("/motifdetection", osc_motif_detection)
     dispatcher.map("/queuenextmotif", osc_queue_next_motif)
     dispatcher.map("/generatemotif", osc_generate_motif)
     dispatcher.map("/retrievenextnote", osc_retrieve_next_note)
     dispatcher.map("/permutatemotif", osc_permutate_motif)
+    dispatcher.map("/jitter", osc_report_jitter)
+    dispatcher.map("/profile/start", osc_profile_start)
+    dispatcher.map("/profile/stop", osc_profile_stop)
+    dispatcher.map("/selectionmode", osc_selection_mode)
+    dispatcher.map("/shedding", osc_report_shedding)
+
+    # Every OSC-triggered task goes through the scheduler (see Scheduling).
+    scheduler = Scheduler(time_to_next_output)
 
     # Create server.
     server = osc_server.ThreadingOSCUDPServer(
@@ -794,6 +1465,9 @@ if __name__ == "__main__":
         generate_motif("pitch")
         generate_motif("duration")
 
+    if analysis_in_worker:
+        start_analysis_worker()
+
     signal.signal(signal.SIGINT, signal_handler)
 
     # Launch the server.
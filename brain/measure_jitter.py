@@ -0,0 +1,129 @@
+"""
+Measure how much motif analysis delays note output.
+
+The real-time loop that P would normally drive over OSC is run here directly:
+retrieve_next_note is polled every millisecond, the queues are refilled
+every 20 ms, a four-note phrase arrives every 10 ms, and a motif is
+permutated every 2 seconds. Each run has two phases of equal length: one
+with only that traffic, and one where a load thread also asks for motif
+detection every few milliseconds over a longer window of notes than usual.
+
+What is reported is f's own output_lateness: how long after its deadline
+each note was actually sent. So that enough notes are sent in a short run,
+f's clock is sped up by --speed (a 1000 ms note lasts 1000/speed ms) and
+lateness is converted back to real milliseconds. Run once with the analysis
+worker and once with --inline to compare:
+
+   python measure_jitter.py
+   python measure_jitter.py --inline
+
+The curses display is replaced with functions that do nothing, and notes are
+sent to the usual output port whether or not Q is listening. The worker only
+sees --notelist-size if it is started with fork (the default on Linux).
+"""
+import argparse
+import threading
+import time
+from collections import deque
+from random import choice
+
+from pythonosc import udp_client
+
+import f
+
+def quiet_display():
+    """
+    -Replaces every curses function in f with one that does nothing
+    """
+    for name in ("motif_to_screen", "cpm_to_screen", "cdm_to_screen",
+                 "input_to_screen", "output_to_screen", "info_check"):
+        setattr(f, name, lambda *args: None)
+
+def speed_up_clock(speed):
+    """
+    -Makes f's time() run speed times faster than real time
+    """
+    start = time.time()
+    f.time = lambda: start + ((time.time() - start) * speed)
+
+def every(interval, func, stopping):
+    """
+    -Calls func every interval seconds until stopping is set
+    """
+    while not stopping.wait(interval):
+        func()
+
+def feed_phrase():
+    """
+    -Stores one four-note phrase
+    """
+    phrase = choice([[60, 62, 64, 65], [67, 65, 64, 62], [55, 60, 59, 57]])
+    for pitch in phrase:
+        f.store_new_note(pitch, choice([400, 900, 1300]), 0.8, 300, 900, 2600, 3000, 3400)
+
+def measure(seconds, load_interval, speed):
+    """
+    -Runs the output loop for the given number of seconds
+    -If load_interval is None, no extra detection is requested
+    -Returns the real lateness (ms) of every note sent
+    """
+    f.output_lateness = deque()
+    stopping = threading.Event()
+    threads = [threading.Thread(target=every, args=(0.02, f.refill_queues, stopping)),
+               threading.Thread(target=every, args=(0.01, feed_phrase, stopping)),
+               threading.Thread(target=every, args=(2.0, f.run_permutation, stopping))]
+    if load_interval is not None:
+        threads.append(threading.Thread(target=every, args=(load_interval, f.run_motif_detection, stopping)))
+    for thread in threads:
+        thread.start()
+
+    end = time.perf_counter() + seconds
+    while (time.perf_counter() < end):
+        f.retrieve_next_note()
+        time.sleep(0.001)
+
+    stopping.set()
+    for thread in threads:
+        thread.join()
+    return [lateness / speed for lateness in f.output_lateness]
+
+def summary(lateness):
+    lateness = sorted(lateness)
+    if not lateness:
+        return "no notes sent"
+    def percentile(p):
+        return lateness[min(int(len(lateness) * p), len(lateness) - 1)]
+    return "{} notes, lateness (ms) mean {:.3f}, p50 {:.3f}, p99 {:.3f}, max {:.3f}".format(
+        len(lateness), sum(lateness) / len(lateness), percentile(0.5), percentile(0.99), lateness[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inline", action="store_true", help="Run the analysis in this process")
+    parser.add_argument("--seconds", type=float, default=10.0, help="How long each phase lasts")
+    parser.add_argument("--load-interval", type=float, default=0.002,
+                        help="Seconds between motif detection requests in the loaded phase")
+    parser.add_argument("--notelist-size", type=int, default=2 * f.notelist_size,
+                        help="Notes checked by each detection (at most 2 * f.max_motif_length)")
+    parser.add_argument("--speed", type=float, default=50.0, help="How much faster f's clock runs")
+    args = parser.parse_args()
+
+    quiet_display()
+    speed_up_clock(args.speed)
+    f.output_client = udp_client.UDPClient("127.0.0.1", f.output_OSC_port)
+    f.analysis_in_worker = not args.inline
+    f.notelist_size = args.notelist_size
+    for i in range(f.max_motif_num):
+        f.generate_motif("pitch")
+        f.generate_motif("duration")
+    if f.analysis_in_worker:
+        worker = f.start_analysis_worker()
+    f.refill_queues()
+    f.last_time = f.time()*1000.0
+
+    mode = "inline" if args.inline else "worker"
+    print("{}, no load:   {}".format(mode, summary(measure(args.seconds, None, args.speed))))
+    print("{}, with load: {}".format(mode, summary(measure(args.seconds, args.load_interval, args.speed))))
+
+    if f.analysis_in_worker:
+        worker.terminate()
+        f.stop_analysis_worker()
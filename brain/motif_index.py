@@ -0,0 +1,91 @@
+"""
+This is a class for finding the motifs most similar to a phrase.
+
+Each motif is turned into a fixed-length feature vector and stored as a
+float32 row of a NumPy matrix, along with the row's squared length. The
+matrix grows as motifs are added. A query finds the squared distance to
+every row at once as |row|^2 - 2 row.q + |q|^2, which is a single
+matrix-vector product.
+"""
+import threading
+
+import numpy as np
+
+contour_length = 8             # Number of points a motif's shape is resampled to
+max_interval = 6               # Intervals larger than this (in semitones) share a bin
+
+def resample(motif, length):
+    """
+    -Stretches or squeezes a motif to a fixed number of points
+    """
+    values = np.asarray(motif, dtype=float)
+    if (len(values) == 1):
+        return np.repeat(values, length)
+    positions = np.linspace(0, len(values) - 1, length)
+    return np.interp(positions, np.arange(len(values)), values)
+
+def pitch_features(motif):
+    """
+    -Returns an interval histogram followed by the motif's contour
+    -Contours are relative to the motif's mean pitch, so transpositions look alike
+    """
+    intervals = np.clip(np.diff(np.asarray(motif, dtype=int)), -max_interval, max_interval)
+    histogram = np.bincount(intervals + max_interval, minlength=(2 * max_interval) + 1).astype(float)
+    if intervals.size:
+        histogram /= intervals.size
+    contour = resample(motif, contour_length)
+    contour = (contour - contour.mean()) / 12.0
+    return np.concatenate((histogram, contour))
+
+def duration_features(motif):
+    """
+    -Returns the motif's duration profile (in seconds) followed by its mean duration
+    """
+    profile = resample(motif, contour_length) / 1000.0
+    return np.append(profile, profile.mean())
+
+class MotifIndex:
+
+    def __init__(self, features, capacity=64):
+        """
+        -features is a function that turns a motif into a 1D array
+        """
+        self.features = features
+        self.dimension = len(features([0, 0]))
+        self.matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self.count = 0
+        self.lock = threading.Lock()   # Motifs are added and queried from different threads
+
+    def __len__(self):
+        return self.count
+
+    def add(self, motif):
+        """
+        -Adds a row for a newly stored motif (rows line up with the motif pool)
+        """
+        row = self.features(motif).astype(np.float32)
+        with self.lock:
+            if (self.count == len(self.matrix)):
+                self.matrix = np.concatenate((self.matrix, np.zeros_like(self.matrix)))
+                self.norms = np.concatenate((self.norms, np.zeros_like(self.norms)))
+            self.matrix[self.count] = row
+            self.norms[self.count] = row.dot(row)
+            self.count += 1
+
+    def nearest(self, phrase, k, farthest=False):
+        """
+        -Returns the indices of the k motifs most similar to phrase
+        -If farthest is True, the k least similar motifs are returned instead
+        """
+        query = self.features(phrase).astype(np.float32)
+        with self.lock:
+            count = self.count
+            distances = self.norms[:count] - (2.0 * self.matrix[:count].dot(query))
+        distances += query.dot(query)
+        if farthest:
+            distances = -distances
+        k = min(k, count)
+        if (k == count):
+            return np.arange(count)
+        return np.argpartition(distances, k - 1)[:k]
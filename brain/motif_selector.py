@@ -0,0 +1,123 @@
+"""
+This is a class for picking motifs at random according to changing weights.
+
+Weights are kept in a Fenwick (binary indexed) tree, so changing one weight
+and drawing a weighted sample both take O(log n) time.
+
+Newer motifs should be more likely to be picked. Rather than shrinking every
+old weight each time a motif is added, each new weight is multiplied by a
+global scale factor that grows by 1/decay. The factor is only divided back
+out of the stored weights when it gets too large for a float.
+
+Motifs are added and picked from different OSC threads, so every public
+method holds the selector's lock while it reads or changes the tree.
+"""
+import threading
+from random import random
+
+class MotifSelector:
+
+    max_scale = 1e200
+
+    def __init__(self, decay=0.9, human_bonus=2.0, play_penalty=0.8, capacity=64):
+        """
+        -decay is how much less likely a motif becomes each time a newer one is added
+        -human_bonus multiplies the weight of motifs detected from the human
+        -play_penalty multiplies a motif's weight every time it is played
+        """
+        self.decay = decay
+        self.human_bonus = human_bonus
+        self.play_penalty = play_penalty
+        self.scale = 1.0
+        self.weights = []
+        self.tree = [0.0] * (capacity + 1)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.weights)
+
+    def add(self, is_human):
+        """
+        -Adds a weight for a newly stored motif and returns its index
+        """
+        with self.lock:
+            weight = self.scale
+            if is_human:
+                weight *= self.human_bonus
+            if (len(self.weights) + 1 >= len(self.tree)):
+                self._rebuild(2 * (len(self.tree) - 1))
+            self.weights.append(0.0)
+            index = len(self.weights) - 1
+            self._set(index, weight)
+
+            self.scale /= self.decay
+            if (self.scale > self.max_scale):
+                self.weights = [w / self.scale for w in self.weights]
+                self.scale = 1.0
+                self._rebuild(len(self.tree) - 1)
+            return index
+
+    def played(self, index):
+        """
+        -Makes a motif less likely to be picked again
+        """
+        with self.lock:
+            self.multiply(index, self.play_penalty)
+
+    def multiply(self, index, factor):
+        """
+        -Multiplies the weight of one motif by factor
+        """
+        with self.lock:
+            self._set(index, self.weights[index] * factor)
+
+    def total(self):
+        """
+        -Returns the sum of every weight
+        """
+        with self.lock:
+            return self._prefix_sum(len(self.weights))
+
+    def sample(self):
+        """
+        -Returns the index of a motif, picked in proportion to its weight
+        """
+        with self.lock:
+            remaining = random() * self.total()
+            position = 0
+            step = 1 << (len(self.tree) - 1).bit_length()
+            while step:
+                next_position = position + step
+                if (next_position < len(self.tree)) and (self.tree[next_position] <= remaining):
+                    position = next_position
+                    remaining -= self.tree[next_position]
+                step >>= 1
+            return min(position, len(self.weights) - 1)   # Guard against rounding past the end
+
+    def _set(self, index, weight):
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+        i = index + 1
+        while (i < len(self.tree)):
+            self.tree[i] += delta
+            i += i & (-i)
+
+    def _prefix_sum(self, count):
+        total = 0.0
+        i = count
+        while (i > 0):
+            total += self.tree[i]
+            i -= i & (-i)
+        return total
+
+    def _rebuild(self, capacity):
+        """
+        -Rebuilds the tree from self.weights in O(n) time
+        """
+        self.tree = [0.0] * (capacity + 1)
+        for index, weight in enumerate(self.weights):
+            self.tree[index + 1] = weight
+        for i in range(1, len(self.tree)):
+            parent = i + (i & (-i))
+            if (parent < len(self.tree)):
+                self.tree[parent] += self.tree[i]
@@ -0,0 +1,83 @@
+"""
+This is a class for sampling the call stacks of a running program.
+
+While started, a background thread periodically records the stack of every
+other thread. The results are written in the collapsed-stack format used by
+flamegraph tools: one line per unique stack, frames separated by semicolons,
+followed by the number of times that stack was seen.
+
+Nothing runs while the profiler is stopped, so it costs nothing until needed.
+"""
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from time import sleep
+
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005):
+        """
+        -interval is the number of seconds between samples
+        """
+        self.interval = interval
+        self.stacks = Counter()
+        self.running = False
+        self.thread = None
+        self.tracing_memory = False
+
+    def start(self, trace_memory=False):
+        """
+        -Starts sampling in a background thread
+        -If trace_memory is True, tracemalloc is also started
+        """
+        if self.running:
+            return
+        self.stacks = Counter()
+        self.running = True
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing_memory = True
+        self.thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self, stack_path, memory_path=None):
+        """
+        -Stops sampling and writes the collapsed stacks to stack_path
+        -If memory was being traced, the largest allocations are written to memory_path
+        """
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join()
+        with open(stack_path, "w") as stack_file:
+            for stack, count in self.stacks.most_common():
+                stack_file.write("{} {}\n".format(stack, count))
+        if self.tracing_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.tracing_memory = False
+            if memory_path is not None:
+                with open(memory_path, "w") as memory_file:
+                    for stat in snapshot.statistics("lineno")[:50]:
+                        memory_file.write("{}\n".format(stat))
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while self.running:
+            for thread_id, frame in sys._current_frames().items():
+                if (thread_id == own_id):
+                    continue
+                self.stacks[self._collapse(frame)] += 1
+            sleep(self.interval)
+
+    def _collapse(self, frame):
+        """
+        -Turns a frame into "outermost;...;innermost" function names
+        """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("{}:{}".format(code.co_filename.split("/")[-1], code.co_name))
+            frame = frame.f_back
+        return ";".join(reversed(names))
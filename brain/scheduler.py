@@ -0,0 +1,97 @@
+"""
+This is a class for running tasks in order of how urgent they are.
+
+Every task has a priority:
+  REALTIME tasks (note output) always run.
+  SOFT tasks (topping up the note queues) are deferred if they wouldn't finish
+  before the next note is due.
+  BACKGROUND tasks (analysis) are deferred for the same reason, and are
+  dropped if they are triggered again while already deferred.
+If the next note is already overdue, nothing is deferred: whatever is
+stopping it from going out, holding back other work won't help.
+
+Deferred tasks are run right after the next REALTIME task, which is when
+there is the most time before the following deadline.
+
+The cost of each task is estimated from how long it has taken before.
+"""
+import threading
+from collections import Counter
+from time import perf_counter
+
+REALTIME = 0
+SOFT = 1
+BACKGROUND = 2
+
+class Scheduler:
+
+    def __init__(self, time_to_deadline, safety_margin=2.0, smoothing=0.2):
+        """
+        -time_to_deadline is a function returning the milliseconds left until the next output
+        -A task only runs if safety_margin times its estimated cost fits before the deadline
+        -smoothing is how quickly cost estimates follow new measurements (0.0 to 1.0)
+        """
+        self.time_to_deadline = time_to_deadline
+        self.safety_margin = safety_margin
+        self.smoothing = smoothing
+        self.costs = {}               # Estimated milliseconds each task takes
+        self.deferred = {}            # Tasks waiting for the next REALTIME task, by name
+        self.deferred_count = Counter()
+        self.dropped_count = Counter()
+        self.lock = threading.Lock()
+
+    def run(self, name, priority, func):
+        """
+        -Runs func now if there is time, otherwise defers or drops it
+        """
+        if (priority == REALTIME):
+            self._measure(name, func)
+            self.run_deferred()
+        elif self._fits(name):
+            self._measure(name, func)
+        else:
+            self._defer(name, priority, func)
+
+    def run_deferred(self):
+        """
+        -Runs deferred tasks, most urgent first, until one doesn't fit
+        """
+        while True:
+            with self.lock:
+                if not self.deferred:
+                    return
+                name = min(self.deferred, key=lambda n: self.deferred[n][0])
+                if not self._fits(name):
+                    return
+                priority, func = self.deferred.pop(name)
+            self._measure(name, func)
+
+    def report(self):
+        """
+        -Returns a one-line summary of the work that has been shed
+        """
+        return "deferred {}, dropped {}".format(sum(self.deferred_count.values()),
+                                                sum(self.dropped_count.values()))
+
+    def _fits(self, name):
+        remaining = self.time_to_deadline()
+        if (remaining < 0):
+            return True    # The output is already late, so waiting won't save it
+        return (self.costs.get(name, 0.0) * self.safety_margin) <= remaining
+
+    def _defer(self, name, priority, func):
+        with self.lock:
+            # Let the estimate shrink while a task is shed, so one slow run can't starve it forever
+            self.costs[name] = self.costs.get(name, 0.0) * (1.0 - self.smoothing)
+            if (name in self.deferred) and (priority == BACKGROUND):
+                self.dropped_count[name] += 1
+                return
+            self.deferred[name] = (priority, func)
+            self.deferred_count[name] += 1
+
+    def _measure(self, name, func):
+        start = perf_counter()
+        func()
+        cost = (perf_counter() - start) * 1000.0
+        old_cost = self.costs.get(name, cost)
+        self.costs[name] = old_cost + (self.smoothing * (cost - old_cost))
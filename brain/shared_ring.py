@@ -0,0 +1,74 @@
+"""
+This is a class for passing fixed-size records between two processes.
+
+The ring lives in a block of shared memory. Exactly one process may push and
+exactly one process may pop. The producer only ever writes the head counter
+and the consumer only ever writes the tail counter, so the two processes
+never need to share a lock. Within each process, though, several threads
+(e.g. the OSC server's) may push or pop at once, so every push and pop holds
+a lock that belongs to that process's SharedRing object.
+"""
+import struct
+import threading
+from multiprocessing import shared_memory
+
+class SharedRing:
+
+    _counter = struct.Struct("Q")
+    _head_offset = 0
+    _tail_offset = 8
+    _data_offset = 16
+
+    def __init__(self, record_format, capacity, name=None):
+        """
+        -Creates a new ring if name is None, otherwise attaches to an existing one
+        -record_format is a struct format string, e.g. "iii"
+        """
+        self.record = struct.Struct(record_format)
+        self.capacity = capacity
+        if name is None:
+            size = self._data_offset + (self.record.size * capacity)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self._counter.pack_into(self.shm.buf, self._head_offset, 0)
+            self._counter.pack_into(self.shm.buf, self._tail_offset, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.lock = threading.Lock()
+
+    def push(self, values):
+        """
+        -Copies one record into the ring
+        -Returns False (and drops the record) if the ring is full
+        """
+        with self.lock:
+            head = self._counter.unpack_from(self.shm.buf, self._head_offset)[0]
+            tail = self._counter.unpack_from(self.shm.buf, self._tail_offset)[0]
+            if (head - tail >= self.capacity):
+                return False
+            offset = self._data_offset + (head % self.capacity) * self.record.size
+            self.record.pack_into(self.shm.buf, offset, *values)
+            self._counter.pack_into(self.shm.buf, self._head_offset, head + 1)
+            return True
+
+    def pop(self):
+        """
+        -Returns the oldest record as a tuple, or None if the ring is empty
+        """
+        with self.lock:
+            head = self._counter.unpack_from(self.shm.buf, self._head_offset)[0]
+            tail = self._counter.unpack_from(self.shm.buf, self._tail_offset)[0]
+            if (head == tail):
+                return None
+            offset = self._data_offset + (tail % self.capacity) * self.record.size
+            values = self.record.unpack_from(self.shm.buf, offset)
+            self._counter.pack_into(self.shm.buf, self._tail_offset, tail + 1)
+            return values
+
+    def close(self, unlink=False):
+        """
+        -Detaches from the shared memory, and frees it if unlink is True
+        """
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
@@ -0,0 +1,52 @@
+"""
+This is a class for turning note values into compact byte strings.
+
+Each distinct value (a pitch or a duration) is given a small integer token
+the first time it is seen. A sequence of values becomes an array('H') of
+tokens, which is stored as bytes. Byte strings hash and compare in C, so they
+are much cheaper to count, look up and search than lists of ints.
+"""
+import threading
+from array import array
+
+token_size = array("H").itemsize
+
+class TokenAlphabet:
+
+    def __init__(self):
+        self.tokens = {}               # value -> token
+        self.values = []               # token -> value
+        self.lock = threading.Lock()   # Values may be interned from several threads at once
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        """
+        -Returns the token for value, giving it a new one if needed
+        """
+        token = self.tokens.get(value)
+        if token is None:
+            with self.lock:
+                token = self.tokens.get(value)   # Another thread may have just added it
+                if token is None:
+                    token = len(self.values)
+                    if (token > 0xFFFF):
+                        raise ValueError("TokenAlphabet is full")
+                    self.values.append(value)
+                    self.tokens[value] = token
+        return token
+
+    def encode(self, sequence):
+        """
+        -Returns a sequence of values as a byte string of tokens
+        """
+        return array("H", [self.intern(value) for value in sequence]).tobytes()
+
+    def decode(self, encoded):
+        """
+        -Returns the list of values a byte string of tokens stands for
+        """
+        tokens = array("H")
+        tokens.frombytes(encoded)
+        return [self.values[token] for token in tokens]